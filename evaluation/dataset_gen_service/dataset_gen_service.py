@@ -1,14 +1,20 @@
 import argparse
-import json
+import asyncio
+import hashlib
 import os
 import random
 import time
 from datetime import datetime
-from typing import Iterable, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
+import diskcache
+import orjson
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langsmith import Client
+from openai import OpenAI
+from ragas.run_config import RunConfig
 from ragas.testset import TestsetGenerator
 from ragas.testset.synthesizers.multi_hop import (
     MultiHopAbstractQuerySynthesizer,
@@ -19,29 +25,42 @@ from ragas.testset.synthesizers.single_hop.specific import (
 )
 
 
-def load_documents(path: str) -> List[Document]:
-    documents: List[Document] = []
-    with open(path, "r", encoding="utf-8") as f:
+T = TypeVar("T")
+
+
+def iter_documents(path: str) -> Iterator[Document]:
+    with open(path, "rb") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            record = json.loads(line)
+            record = orjson.loads(line)
             text = record.get("text")
             if not text:
                 continue
             metadata = record.get("metadata", {})
-            documents.append(Document(page_content=text, metadata=metadata))
-    return documents
+            yield Document(page_content=text, metadata=metadata)
 
 
-def filter_short_documents(documents: List[Document], min_tokens: int) -> List[Document]:
-    filtered = []
+def filter_short_documents(documents: Iterable[Document], min_tokens: int) -> Iterator[Document]:
     for doc in documents:
         token_count = len(doc.page_content.split())
         if token_count >= min_tokens:
-            filtered.append(doc)
-    return filtered
+            yield doc
+
+
+def reservoir_sample(items: Iterable[T], k: int, seed: int) -> List[T]:
+    # Algorithm R: uniform sample of k items in a single pass.
+    rng = random.Random(seed)
+    reservoir: List[T] = []
+    for idx, item in enumerate(items):
+        if idx < k:
+            reservoir.append(item)
+            continue
+        j = rng.randint(0, idx)
+        if j < k:
+            reservoir[j] = item
+    return reservoir
 
 
 class TemperatureFreeChatOpenAI(ChatOpenAI):
@@ -66,13 +85,155 @@ class TemperatureFreeChatOpenAI(ChatOpenAI):
         return payload
 
 
-def build_generator() -> TestsetGenerator:
-    llm = TemperatureFreeChatOpenAI(
-        model="gpt-5-mini",
-        model_kwargs={"response_format": {"type": "json_object"}},
-    )
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    return TestsetGenerator.from_langchain(llm, embeddings)
+class OpenAIBatchQueue:
+    # Collects concurrent chat completion requests and submits them as one
+    # OpenAI Batch API job, resolving each caller once the job completes.
+    def __init__(self, client: OpenAI, window_seconds: float = 2.0, poll_seconds: float = 30.0):
+        self.client = client
+        self.window_seconds = window_seconds
+        self.poll_seconds = poll_seconds
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, body: dict) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((body, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        # Wait for a quiet window so one job covers every prompt of a ragas stage.
+        seen = -1
+        while seen != len(self._pending):
+            seen = len(self._pending)
+            await asyncio.sleep(self.window_seconds)
+        pending, self._pending = self._pending, []
+        self._flush_task = None
+        try:
+            results = await asyncio.to_thread(self._run_batch, [body for body, _ in pending])
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for idx, (_, future) in enumerate(pending):
+            if future.done():
+                continue
+            result = results.get(str(idx))
+            if result is None:
+                future.set_exception(RuntimeError(f"Batch request {idx} returned no result."))
+            else:
+                future.set_result(result)
+
+    def _run_batch(self, bodies: List[dict]) -> Dict[str, dict]:
+        lines = [
+            orjson.dumps(
+                {
+                    "custom_id": str(idx),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body,
+                }
+            )
+            for idx, body in enumerate(bodies)
+        ]
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", b"\n".join(lines)),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        print(f"Submitted OpenAI batch {batch.id} with {len(bodies)} requests.")
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_seconds)
+            batch = self.client.batches.retrieve(batch.id)
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"OpenAI batch {batch.id} ended with status {batch.status}.")
+
+        results: Dict[str, dict] = {}
+        output = self.client.files.content(batch.output_file_id).content
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                results[record["custom_id"]] = response["body"]
+        return results
+
+
+class BatchAPIChatOpenAI(TemperatureFreeChatOpenAI):
+    # Async generations go through the Batch API; sync calls stay online.
+    batch_queue: Any = None
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        payload = self._get_request_payload(messages, stop=stop, **kwargs)
+        payload.pop("stream", None)
+        response = await self.batch_queue.submit(payload)
+        return self._create_chat_result(response)
+
+
+class CachedEmbeddings(Embeddings):
+    # Memoizes vectors on disk keyed by model and content hash.
+    def __init__(self, embeddings: OpenAIEmbeddings, cache: diskcache.Cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _cache_key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{self.embeddings.model}:{digest}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._cache_key(text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        misses: Dict[str, str] = {
+            key: text for key, text, vector in zip(keys, texts, vectors) if vector is None
+        }
+        if misses:
+            fresh = self.embeddings.embed_documents(list(misses.values()))
+            found = dict(zip(misses, fresh))
+            for key, vector in found.items():
+                self.cache.set(key, vector)
+            vectors = [
+                found[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+_embeddings: Optional[Embeddings] = None
+
+
+def get_embeddings(cache_dir: str) -> Embeddings:
+    global _embeddings
+    if _embeddings is None:
+        embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        if cache_dir:
+            embeddings = CachedEmbeddings(embeddings, diskcache.Cache(cache_dir))
+        _embeddings = embeddings
+    return _embeddings
+
+
+def build_generator(
+    embedding_cache: str,
+    batch_queue: Optional[OpenAIBatchQueue] = None,
+) -> TestsetGenerator:
+    llm_kwargs = {
+        "model": "gpt-5-mini",
+        "model_kwargs": {"response_format": {"type": "json_object"}},
+    }
+    if batch_queue is not None:
+        llm = BatchAPIChatOpenAI(batch_queue=batch_queue, **llm_kwargs)
+    else:
+        llm = TemperatureFreeChatOpenAI(**llm_kwargs)
+    return TestsetGenerator.from_langchain(llm, get_embeddings(embedding_cache))
 
 
 def generate_testset(generator: TestsetGenerator, docs: List[Document]):
@@ -108,6 +269,24 @@ def normalize_question(value) -> str:
     return value or ""
 
 
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    # Walk the exception chain since ragas may wrap the underlying HTTP error.
+    seen = set()
+    current: Optional[BaseException] = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        response = getattr(current, "response", None)
+        headers = getattr(response, "headers", None)
+        value = headers.get("retry-after") if headers is not None else None
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        current = current.__cause__ or current.__context__
+    return None
+
+
 def generate_testset_with_pacing(
     generator: TestsetGenerator,
     docs: List[Document],
@@ -117,12 +296,15 @@ def generate_testset_with_pacing(
     max_retries: int,
     retry_sleep_seconds: float,
     retry_backoff: float,
+    retry_max_sleep_seconds: float = 60.0,
+    run_config: Optional[RunConfig] = None,
 ) -> List[dict]:
     query_distribution = [
         (SingleHopSpecificQuerySynthesizer(llm=generator.llm), 0.5),
         (MultiHopAbstractQuerySynthesizer(llm=generator.llm), 0.25),
         (MultiHopSpecificQuerySynthesizer(llm=generator.llm), 0.25),
     ]
+    generate_kwargs = {"run_config": run_config} if run_config is not None else {}
     rows: List[dict] = []
     remaining = total
     while remaining > 0:
@@ -135,6 +317,7 @@ def generate_testset_with_pacing(
                     docs,
                     testset_size=current_size,
                     query_distribution=query_distribution,
+                    **generate_kwargs,
                 )
                 break
             except Exception as exc:
@@ -153,7 +336,15 @@ def generate_testset_with_pacing(
                 )
                 if not (is_rate_limit or is_transient) or attempt >= max_retries:
                     raise
-                sleep_for = retry_sleep_seconds * (retry_backoff ** attempt)
+                # Jitter desynchronizes workers that hit the limit together.
+                sleep_for = min(
+                    retry_sleep_seconds * (retry_backoff ** attempt)
+                    + random.uniform(0, 0.5 * retry_sleep_seconds),
+                    retry_max_sleep_seconds,
+                )
+                retry_after = retry_after_seconds(exc)
+                if retry_after is not None and retry_after > sleep_for:
+                    sleep_for = retry_after
                 print(
                     f"Rate limit hit; sleeping {sleep_for:.1f}s before retry "
                     f"({attempt + 1}/{max_retries})..."
@@ -168,23 +359,32 @@ def generate_testset_with_pacing(
     return rows
 
 
+_datasets: Dict[str, Any] = {}
+
+
 def get_dataset(client: Client, name: str):
+    # Only found datasets are memoized so a later create_dataset is picked up.
+    if name in _datasets:
+        return _datasets[name]
     try:
-        return client.read_dataset(dataset_name=name)
+        dataset = client.read_dataset(dataset_name=name)
     except Exception:
-        datasets = list(client.list_datasets())
-        for dataset in datasets:
-            if dataset.name == name:
-                return dataset
-    return None
+        dataset = next(
+            (d for d in client.list_datasets(dataset_name=name) if d.name == name),
+            None,
+        )
+    if dataset is not None:
+        _datasets[name] = dataset
+    return dataset
 
 
-def upload_to_langsmith(dataset_name: str, rows: List[dict]) -> None:
+def upload_to_langsmith(dataset_name: str, rows: List[dict], batch_size: int = 50) -> None:
     client = Client()
     dataset = get_dataset(client, dataset_name)
     if not dataset:
         dataset = client.create_dataset(dataset_name)
 
+    examples: List[dict] = []
     for row in rows:
         question = (
             row.get("question")
@@ -205,10 +405,15 @@ def upload_to_langsmith(dataset_name: str, rows: List[dict]) -> None:
             or row.get("retrieved_contexts"),
             "type": row.get("evolution_type") or row.get("synthesizer_name"),
         }
-        client.create_example(
-            inputs=inputs,
-            outputs=outputs,
-            metadata=metadata,
+        examples.append({"inputs": inputs, "outputs": outputs, "metadata": metadata})
+
+    # Upload in bounded batches to keep each request well under the payload limit.
+    for i in range(0, len(examples), batch_size):
+        batch = examples[i : i + batch_size]
+        client.create_examples(
+            inputs=[example["inputs"] for example in batch],
+            outputs=[example["outputs"] for example in batch],
+            metadata=[example["metadata"] for example in batch],
             dataset_id=dataset.id,
         )
 
@@ -242,6 +447,14 @@ def parse_args() -> argparse.Namespace:
         ),
         help="Path to save/load a local JSONL cache of generated questions.",
     )
+    parser.add_argument(
+        "--embedding-cache",
+        default=os.getenv(
+            "DATASET_EMBEDDING_CACHE",
+            "evaluation/dataset_gen_service/cache/emb",
+        ),
+        help="Directory for the on-disk embedding cache (empty to disable).",
+    )
     parser.add_argument(
         "--doc-fraction",
         type=float,
@@ -296,6 +509,37 @@ def parse_args() -> argparse.Namespace:
         default=float(os.getenv("DATASET_RETRY_BACKOFF", "2.0")),
         help="Backoff multiplier for rate limit retries.",
     )
+    parser.add_argument(
+        "--retry-max-sleep-seconds",
+        type=float,
+        default=float(os.getenv("DATASET_RETRY_MAX_SLEEP_SECONDS", "60.0")),
+        help="Upper bound on the backoff sleep between retries.",
+    )
+    batch_api_default = os.getenv("DATASET_USE_BATCH_API", "").lower() in ("1", "true", "yes")
+    parser.add_argument(
+        "--use-batch-api",
+        action="store_true",
+        default=batch_api_default,
+        help="Route generation LLM calls through the OpenAI Batch API.",
+    )
+    parser.add_argument(
+        "--batch-api-min-total",
+        type=int,
+        default=int(os.getenv("DATASET_BATCH_API_MIN_TOTAL", "100")),
+        help="Only use the Batch API when --total exceeds this value.",
+    )
+    parser.add_argument(
+        "--batch-api-poll-seconds",
+        type=float,
+        default=float(os.getenv("DATASET_BATCH_API_POLL_SECONDS", "30.0")),
+        help="Seconds between Batch API status checks.",
+    )
+    parser.add_argument(
+        "--upload-batch-size",
+        type=int,
+        default=int(os.getenv("DATASET_UPLOAD_BATCH_SIZE", "50")),
+        help="Examples per LangSmith bulk upload request.",
+    )
     return parser.parse_args()
 
 
@@ -313,40 +557,49 @@ def main() -> None:
     args = parse_args()
     validate_env()
 
-    print("Loading documents...")
-    docs = load_documents(args.input)
-    if not docs:
-        raise RuntimeError("No documents loaded from input file.")
-    print(f"Loaded {len(docs)} documents.")
-
-    docs = filter_short_documents(docs, args.min_doc_tokens)
-    if not docs:
-        raise RuntimeError("No documents left after filtering short chunks.")
-    print(f"Retained {len(docs)} documents after filtering.")
-
     if not (0.0 < args.doc_fraction <= 1.0):
         raise ValueError("--doc-fraction must be between 0 and 1.")
 
+    def retained_documents() -> Iterator[Document]:
+        return filter_short_documents(iter_documents(args.input), args.min_doc_tokens)
+
+    print("Loading documents...")
     if args.doc_fraction < 1.0:
-        random.seed(args.doc_seed)
-        sample_size = max(1, int(len(docs) * args.doc_fraction))
-        docs = random.sample(docs, sample_size)
+        # Count in one streaming pass, then sample in a second, so only the
+        # sampled subset is ever held in memory.
+        retained = sum(1 for _ in retained_documents())
+        if not retained:
+            raise RuntimeError("No documents left after filtering short chunks.")
+        print(f"Retained {retained} documents after filtering.")
+        sample_size = max(1, int(retained * args.doc_fraction))
+        docs = reservoir_sample(retained_documents(), sample_size, args.doc_seed)
         print(f"Sampled {len(docs)} documents for generation.")
+    else:
+        docs = list(retained_documents())
+        if not docs:
+            raise RuntimeError("No documents left after filtering short chunks.")
+        print(f"Retained {len(docs)} documents after filtering.")
+
+    use_batch_api = args.use_batch_api and args.total > args.batch_api_min_total
+    batch_queue = None
+    if use_batch_api:
+        print("Using the OpenAI Batch API for generation LLM calls.")
+        batch_queue = OpenAIBatchQueue(OpenAI(), poll_seconds=args.batch_api_poll_seconds)
 
     print("Building testset generator...")
-    generator = build_generator()
+    generator = build_generator(args.embedding_cache, batch_queue)
 
     cache_path = args.cache_path
     dataset_name = args.dataset_name.strip()
     if os.path.exists(cache_path):
         print(f"Found cached dataset at {cache_path}; loading.")
         rows = []
-        with open(cache_path, "r", encoding="utf-8") as f:
+        with open(cache_path, "rb") as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
-                rows.append(json.loads(line))
+                rows.append(orjson.loads(line))
     else:
         print("Generating testset...")
         if args.batch_size < 1:
@@ -361,20 +614,32 @@ def main() -> None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             dataset_name = f"AE_Scripting_Guide_Golden_Set_{timestamp}"
 
+        run_config = None
+        batch_size = args.batch_size
+        sleep_seconds = args.sleep_seconds
+        if use_batch_api:
+            # Batch jobs are not paced by online rate limits, so generate in one
+            # pass with enough workers and a timeout that covers the job window.
+            run_config = RunConfig(timeout=24 * 60 * 60, max_workers=256)
+            batch_size = args.total
+            sleep_seconds = 0.0
+
         rows = generate_testset_with_pacing(
             generator,
             docs,
             total=args.total,
-            batch_size=args.batch_size,
-            sleep_seconds=args.sleep_seconds,
+            batch_size=batch_size,
+            sleep_seconds=sleep_seconds,
             max_retries=args.max_retries,
             retry_sleep_seconds=args.retry_sleep_seconds,
             retry_backoff=args.retry_backoff,
+            retry_max_sleep_seconds=args.retry_max_sleep_seconds,
+            run_config=run_config,
         )
         os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, "w", encoding="utf-8") as f:
+        with open(cache_path, "wb") as f:
             for row in rows:
-                f.write(json.dumps(row, ensure_ascii=True) + "\n")
+                f.write(orjson.dumps(row, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
         print(f"Saved local cache to {cache_path}")
 
     if not dataset_name:
@@ -382,7 +647,9 @@ def main() -> None:
         dataset_name = f"AE_Scripting_Guide_Golden_Set_{timestamp}"
 
     print(f"Uploading to LangSmith dataset: {dataset_name}")
-    upload_to_langsmith(dataset_name, rows)
+    if args.upload_batch_size < 1:
+        raise ValueError("--upload-batch-size must be at least 1.")
+    upload_to_langsmith(dataset_name, rows, batch_size=args.upload_batch_size)
     print("Upload complete.")
 
 
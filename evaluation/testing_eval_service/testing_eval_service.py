@@ -1,11 +1,17 @@
 import argparse
+import asyncio
+import itertools
+import math
 import os
 import sys
+import threading
 from datetime import datetime
-from typing import Any, Dict, List, Tuple
+from statistics import fmean
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
 
-import pandas as pd
-import requests
+import httpx
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langsmith import Client
 from ragas import evaluate
@@ -15,29 +21,50 @@ from ragas.metrics._faithfulness import faithfulness
 from datasets import Dataset
 
 
+class CountingSQLiteCache(SQLiteCache):
+    # Tracks lookups so the run can report how many LLM calls the cache absorbed.
+    def __init__(self, database_path: str):
+        super().__init__(database_path=database_path)
+        self.lookups = 0
+        self.hits = 0
+        # alookup runs lookups on executor threads while ragas evaluates concurrently.
+        self._counter_lock = threading.Lock()
+
+    def lookup(self, prompt: str, llm_string: str):
+        result = super().lookup(prompt, llm_string)
+        with self._counter_lock:
+            self.lookups += 1
+            if result is not None:
+                self.hits += 1
+        return result
+
+
 def add_repo_to_path(repo_root: str) -> None:
     if repo_root not in sys.path:
         sys.path.append(repo_root)
 
 
-def build_rag_runner(persist_dir: str, collection_name: str) -> Any:
+def build_rag_runner(
+    persist_dir: str,
+    collection_name: str,
+    http_client: httpx.AsyncClient,
+) -> Callable[[str], Awaitable[Tuple[str, List[str]]]]:
     service_url = os.getenv("RETRIEVAL_QA_URL", "http://retrieval_qa:8000/query")
 
-    def run_qa(query: str) -> Tuple[str, List[str]]:
-        response = requests.post(service_url, json={"query": query}, timeout=120)
+    async def arun_qa(query: str) -> Tuple[str, List[str]]:
+        response = await http_client.post(service_url, json={"query": query})
         response.raise_for_status()
         payload = response.json()
         return payload["answer"], payload.get("source_documents", [])
 
-    return run_qa
+    return arun_qa
 
 
 def get_dataset_by_name(client: Client, name: str):
     try:
         return client.read_dataset(dataset_name=name)
     except Exception:
-        datasets = list(client.list_datasets())
-        for dataset in datasets:
+        for dataset in client.list_datasets(dataset_name=name):
             if dataset.name == name:
                 return dataset
     raise RuntimeError(f"Dataset not found: {name}")
@@ -72,21 +99,12 @@ def parse_example(example) -> Tuple[str, str]:
     return question, ground_truth
 
 
-def evaluate_example(
+def evaluate_records(
     llm: ChatOpenAI,
     embeddings: OpenAIEmbeddings,
-    question: str,
-    answer: str,
-    contexts: List[str],
-    ground_truth: str,
-) -> Dict[str, float]:
-    record = {
-        "question": question,
-        "answer": answer,
-        "contexts": contexts,
-        "ground_truth": ground_truth,
-    }
-    dataset = Dataset.from_list([record])
+    records: List[Dict[str, Any]],
+) -> List[Dict[str, float]]:
+    dataset = Dataset.from_list(records)
     column_map = {
         "user_input": "question",
         "response": "answer",
@@ -100,13 +118,19 @@ def evaluate_example(
         embeddings=embeddings,
         column_map=column_map,
     )
-    df = result.to_pandas()
-    scores = df.iloc[0].to_dict()
-    return {
-        "faithfulness": float(scores.get("faithfulness", 0.0)),
-        "answer_relevancy": float(scores.get("answer_relevancy", 0.0)),
-        "context_precision": float(scores.get("context_precision", 0.0)),
-    }
+    # Older ragas results only expose per-row scores through to_pandas().
+    if hasattr(result, "scores"):
+        row_scores = result.scores
+    else:
+        row_scores = result.to_pandas().to_dict(orient="records")
+    return [
+        {
+            "faithfulness": float(scores.get("faithfulness", 0.0)),
+            "answer_relevancy": float(scores.get("answer_relevancy", 0.0)),
+            "context_precision": float(scores.get("context_precision", 0.0)),
+        }
+        for scores in row_scores
+    ]
 
 
 def parse_args() -> argparse.Namespace:
@@ -144,6 +168,17 @@ def parse_args() -> argparse.Namespace:
         default=os.getenv("SKIP_LANGSMITH_LOGGING", "").lower() in ("1", "true", "yes"),
         help="Skip creating LangSmith runs/feedback to avoid rate limits.",
     )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=int(os.getenv("EVAL_MAX_CONCURRENCY", "16")),
+        help="Maximum number of examples evaluated concurrently.",
+    )
+    parser.add_argument(
+        "--llm-cache-path",
+        default=os.getenv("LLM_CACHE_PATH", ".cache/langchain_llm.db"),
+        help="SQLite path for the LangChain LLM cache (empty to disable).",
+    )
     return parser.parse_args()
 
 
@@ -157,18 +192,111 @@ def validate_env() -> None:
         raise RuntimeError(f"Missing required env vars: {', '.join(missing)}")
 
 
+def log_to_langsmith(
+    client: Client,
+    experiment_name: str,
+    example_id: Any,
+    question: str,
+    answer: str,
+    scores: Dict[str, float],
+) -> None:
+    run = client.create_run(
+        name="rag-eval",
+        run_type="chain",
+        inputs={"question": question},
+        outputs={"answer": answer},
+        project_name=experiment_name,
+        reference_example_id=example_id,
+    )
+    for key, value in scores.items():
+        client.create_feedback(
+            run_id=run.id,
+            key=key,
+            score=value,
+        )
+
+
+async def collect_records(
+    args: argparse.Namespace,
+    examples: Iterator[Any],
+    total: Optional[int] = None,
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    if args.max_concurrency < 1:
+        raise ValueError("--max-concurrency must be at least 1.")
+
+    semaphore = asyncio.Semaphore(args.max_concurrency)
+    total_label = str(total) if total else "?"
+
+    # One pooled client keeps connections to the RAG service alive across examples.
+    limits = httpx.Limits(
+        max_connections=args.max_concurrency,
+        max_keepalive_connections=args.max_concurrency,
+    )
+    async with httpx.AsyncClient(http2=True, timeout=120.0, limits=limits) as http_client:
+        arun_qa = build_rag_runner(args.persist_dir, args.collection, http_client)
+
+        async def sem_run(idx: int, question: str, ground_truth: str) -> Dict[str, Any]:
+            async with semaphore:
+                print(f"[{idx}/{total_label}] Running RAG: {question[:80]}")
+                answer, contexts = await arun_qa(question)
+            return {
+                "question": question,
+                "answer": answer,
+                "contexts": contexts,
+                "ground_truth": ground_truth,
+            }
+
+        # Launch tasks as LangSmith pages arrive; pagination runs off the event loop.
+        pending: List[Any] = []
+        tasks: List[asyncio.Task] = []
+        seen = 0
+        while True:
+            example = await asyncio.to_thread(next, examples, None)
+            if example is None:
+                break
+            seen += 1
+            try:
+                question, ground_truth = parse_example(example)
+            except ValueError as exc:
+                print(f"Skipping example {example.id}: {exc}")
+                continue
+            pending.append(example)
+            tasks.append(asyncio.create_task(sem_run(seen, question, ground_truth)))
+
+        if not seen:
+            raise RuntimeError("No examples found in the dataset.")
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    records: List[Tuple[Any, Dict[str, Any]]] = []
+    for example, result in zip(pending, results):
+        if isinstance(result, Exception):
+            print(f"Error on example {example.id}: {result}")
+            continue
+        records.append((example, result))
+    return records
+
+
 def main() -> None:
     args = parse_args()
     validate_env()
     add_repo_to_path(args.repo_root)
 
+    llm_cache: Optional[CountingSQLiteCache] = None
+    if args.llm_cache_path:
+        cache_dir = os.path.dirname(args.llm_cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        llm_cache = CountingSQLiteCache(database_path=args.llm_cache_path)
+        set_llm_cache(llm_cache)
+
     client = Client()
     dataset = get_dataset_by_name(client, args.dataset_name)
-    examples = list(client.list_examples(dataset_id=dataset.id))
-    if not examples:
-        raise RuntimeError("No examples found in the dataset.")
+    examples = iter(client.list_examples(dataset_id=dataset.id))
     if args.debug_example:
-        sample = examples[0]
+        sample = next(examples, None)
+        if sample is None:
+            raise RuntimeError("No examples found in the dataset.")
+        examples = itertools.chain([sample], examples)
         print(f"Sample example id: {sample.id}")
         raw_inputs = sample.inputs or {}
         raw_outputs = sample.outputs or {}
@@ -185,62 +313,47 @@ def main() -> None:
         print(f"Sample inputs keys: {list(raw_inputs.keys())}")
         print(f"Sample outputs keys: {list(raw_outputs.keys())}")
 
+    total = getattr(dataset, "example_count", None)
+    records = asyncio.run(collect_records(args, examples, total))
+    if not records:
+        print("No evaluation results were produced. Check dataset inputs.")
+        return
+
     llm = ChatOpenAI(model="gpt-4o", temperature=0)
     embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    run_qa = build_rag_runner(args.persist_dir, args.collection)
+    print(f"Scoring {len(records)} examples with ragas...")
+    all_scores = evaluate_records(llm, embeddings, [record for _, record in records])
+    if llm_cache and llm_cache.lookups:
+        print(
+            f"LLM cache hits: {llm_cache.hits}/{llm_cache.lookups} "
+            f"({llm_cache.hits / llm_cache.lookups:.1%})"
+        )
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     experiment_name = f"AE_RAG_Eval_{timestamp}"
 
     rows: List[Dict[str, Any]] = []
-    for idx, example in enumerate(examples, start=1):
-        try:
-            question, ground_truth = parse_example(example)
-        except ValueError as exc:
-            print(f"Skipping example {example.id}: {exc}")
-            continue
-
-        print(f"[{idx}/{len(examples)}] Evaluating: {question[:80]}")
-        try:
-            answer, contexts = run_qa(question)
-            scores = evaluate_example(
-                llm,
-                embeddings,
-                question,
-                answer,
-                contexts,
-                ground_truth,
-            )
-
-            if not args.skip_langsmith_logging:
-                run = client.create_run(
-                    name="rag-eval",
-                    run_type="chain",
-                    inputs={"question": question},
-                    outputs={"answer": answer},
-                    project_name=experiment_name,
-                    reference_example_id=example.id,
+    for (example, record), scores in zip(records, all_scores):
+        if not args.skip_langsmith_logging:
+            try:
+                log_to_langsmith(
+                    client,
+                    experiment_name,
+                    example.id,
+                    record["question"],
+                    record["answer"],
+                    scores,
                 )
-                for key, value in scores.items():
-                    client.create_feedback(
-                        run_id=run.id,
-                        key=key,
-                        score=value,
-                    )
-
-            rows.append({"question": question, **scores})
-        except Exception as exc:
-            print(f"Error on example {example.id}: {exc}")
-            continue
-
-    if not rows:
-        print("No evaluation results were produced. Check dataset inputs.")
-        return
+            except Exception as exc:
+                print(f"Error logging example {example.id}: {exc}")
+        rows.append({"question": record["question"], **scores})
 
-    df = pd.DataFrame(rows)
-    summary = df[["faithfulness", "answer_relevancy", "context_precision"]].mean()
     print("\nAverage scores:")
-    print(summary.to_frame(name="score"))
+    for key in ("faithfulness", "answer_relevancy", "context_precision"):
+        # Skip NaN scores (failed metric calls), matching DataFrame.mean().
+        values = [row[key] for row in rows if not math.isnan(row[key])]
+        mean = fmean(values) if values else float("nan")
+        print(f"{key}: {mean:.4f}")
 
 
 if __name__ == "__main__":
@@ -6,6 +6,11 @@ from bs4 import BeautifulSoup
 from markdownify import markdownify as md
 
 
+_PERM_LINK = re.compile(r'\[¶\]\(#[^\)]+\s"Permanent link"\)')
+_SKIP_TO = re.compile(r'\[Skip to content\]\(#index\)')
+_MULTINL = re.compile(r"\n{3,}")
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Convert an HTML file to Markdown.")
     parser.add_argument(
@@ -23,13 +28,13 @@ def parse_args() -> argparse.Namespace:
 
 def clean_ae_markdown(text: str) -> str:
     # Remove "Permanent link" icons and anchors.
-    text = re.sub(r'\[¶\]\(#[^\)]+\s"Permanent link"\)', "", text)
+    text = _PERM_LINK.sub("", text)
 
     # Remove "Skip to content" style links.
-    text = re.sub(r'\[Skip to content\]\(#index\)', "", text)
+    text = _SKIP_TO.sub("", text)
 
     # Fix multiple newlines created by the cleaning.
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _MULTINL.sub("\n\n", text)
 
     return text
 
@@ -44,7 +49,7 @@ def main() -> None:
     with open(args.input, "r", encoding="utf-8") as f:
         html_content = f.read()
 
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = BeautifulSoup(html_content, "lxml")
 
     # Remove scripts, styles, or navigation if they exist in the file.
     for element in soup(["script", "style", "nav", "footer"]):
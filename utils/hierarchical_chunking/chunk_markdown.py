@@ -1,11 +1,21 @@
 import argparse
-import json
+import hashlib
 import os
-from typing import List, Tuple
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
+import diskcache
+import numpy as np
+import orjson
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import MarkdownHeaderTextSplitter
-from langchain_experimental.text_splitter import SemanticChunker
+
+
+# Same sentence boundary and breakpoint defaults as langchain's SemanticChunker.
+_SENTENCE_SPLIT = re.compile(r"(?<=[.?!])\s+")
+_BREAKPOINT_PERCENTILE = 95
 
 
 def parse_args() -> argparse.Namespace:
@@ -40,9 +50,57 @@ def parse_args() -> argparse.Namespace:
         default=50,
         help="Approximate token overlap between adjacent chunks.",
     )
+    parser.add_argument(
+        "--embedding-cache",
+        default=".cache/emb",
+        help="Directory for the on-disk embedding cache (empty to disable).",
+    )
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        default=512,
+        help="Number of sentences per embedding request.",
+    )
+    parser.add_argument(
+        "--embedding-workers",
+        type=int,
+        default=16,
+        help="Number of embedding requests in flight at once.",
+    )
     return parser.parse_args()
 
 
+class CachedEmbeddings(Embeddings):
+    # Memoizes vectors on disk keyed by model and content hash.
+    def __init__(self, embeddings: OpenAIEmbeddings, cache: diskcache.Cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _cache_key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{self.embeddings.model}:{digest}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._cache_key(text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        misses: Dict[str, str] = {
+            key: text for key, text, vector in zip(keys, texts, vectors) if vector is None
+        }
+        if misses:
+            fresh = self.embeddings.embed_documents(list(misses.values()))
+            found = dict(zip(misses, fresh))
+            for key, vector in found.items():
+                self.cache.set(key, vector)
+            vectors = [
+                found[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
 def build_header_rules() -> List[Tuple[str, str]]:
     return [
         ("#", "Header_1"),
@@ -52,6 +110,52 @@ def build_header_rules() -> List[Tuple[str, str]]:
     ]
 
 
+_HEADER_SPLITTER = MarkdownHeaderTextSplitter(headers_to_split_on=build_header_rules())
+
+
+def combine_sentences(sentences: List[str], buffer_size: int = 1) -> List[str]:
+    return [
+        " ".join(sentences[max(0, i - buffer_size) : i + 1 + buffer_size])
+        for i in range(len(sentences))
+    ]
+
+
+def embed_in_batches(
+    embeddings: Embeddings,
+    texts: List[str],
+    batch_size: int,
+    max_workers: int = 16,
+) -> np.ndarray:
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    vectors: List[List[float]] = []
+    # Embedding requests are independent HTTP calls; map keeps results in order.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_vectors in executor.map(embeddings.embed_documents, batches):
+            vectors.extend(batch_vectors)
+    return np.asarray(vectors, dtype=np.float64)
+
+
+def split_on_breakpoints(sentences: List[str], vectors: np.ndarray) -> List[str]:
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    distances = 1.0 - np.einsum("ij,ij->i", normed[:-1], normed[1:])
+    threshold = np.percentile(distances, _BREAKPOINT_PERCENTILE)
+    breakpoints = np.nonzero(distances > threshold)[0] + 1
+    return [
+        " ".join(sentences[group[0] : group[-1] + 1])
+        for group in np.split(np.arange(len(sentences)), breakpoints)
+    ]
+
+
+def tail_tokens(parts: List[str], count: int) -> List[str]:
+    # Last `count` words of the joined parts, splitting only as many parts as needed.
+    tokens: List[str] = []
+    for part in reversed(parts):
+        tokens = part.split() + tokens
+        if len(tokens) >= count:
+            break
+    return tokens[-count:]
+
+
 def main() -> None:
     args = parse_args()
 
@@ -65,13 +169,13 @@ def main() -> None:
     if not os.getenv("OPENAI_API_KEY"):
         raise RuntimeError("OPENAI_API_KEY is not set.")
 
-    header_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=build_header_rules())
-    sections = header_splitter.split_text(markdown_text)
+    sections = _HEADER_SPLITTER.split_text(markdown_text)
 
     embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    semantic_splitter = SemanticChunker(embeddings)
+    if args.embedding_cache:
+        embeddings = CachedEmbeddings(embeddings, diskcache.Cache(args.embedding_cache))
 
-    semantic_chunks: List[Tuple[str, dict]] = []
+    section_sentences: List[Tuple[List[str], dict]] = []
     for section in sections:
         section_text = section.page_content
         header_path = " > ".join(
@@ -79,54 +183,85 @@ def main() -> None:
         ).strip()
         if header_path:
             section_text = f"{header_path}\n\n{section_text}"
+        section_sentences.append((_SENTENCE_SPLIT.split(section_text), section.metadata))
+
+    # Embed every section's sentence windows up front so requests are batched
+    # across sections instead of issued once per section.
+    combined = [
+        window
+        for sentences, _ in section_sentences
+        if len(sentences) > 1
+        for window in combine_sentences(sentences)
+    ]
+    vectors = embed_in_batches(
+        embeddings,
+        combined,
+        args.embedding_batch_size,
+        max_workers=args.embedding_workers,
+    )
 
-        for chunk in semantic_splitter.split_text(section_text):
-            semantic_chunks.append((chunk, dict(section.metadata)))
+    semantic_chunks: List[Tuple[str, dict]] = []
+    offset = 0
+    for sentences, metadata in section_sentences:
+        if len(sentences) > 1:
+            chunks = split_on_breakpoints(sentences, vectors[offset : offset + len(sentences)])
+            offset += len(sentences)
+        else:
+            chunks = sentences
+        for chunk in chunks:
+            semantic_chunks.append((chunk, dict(metadata)))
 
     merged_sections: List[Tuple[str, dict]] = []
-    buffer_text = ""
+    # Parts are joined only when a merged chunk is emitted, and the running
+    # word count avoids re-splitting the buffer on every merge.
+    buffer_parts: List[str] = []
     buffer_metadata = {}
     buffer_count = 0
+    buffer_tokens = 0
 
     for chunk_text, chunk_metadata in semantic_chunks:
-        if not buffer_text:
-            buffer_text = chunk_text
+        chunk_tokens = len(chunk_text.split())
+        if not buffer_parts:
+            buffer_parts = [chunk_text]
             buffer_metadata = chunk_metadata
             buffer_count = 1
+            buffer_tokens = chunk_tokens
         else:
-            buffer_text = f"{buffer_text}\n\n{chunk_text}"
+            buffer_parts.append(chunk_text)
             buffer_count += 1
+            buffer_tokens += chunk_tokens
 
-        token_count = len(buffer_text.split())
-        if token_count >= args.chunk_size:
+        if buffer_tokens >= args.chunk_size:
             if buffer_count > 1:
                 buffer_metadata = dict(buffer_metadata)
                 buffer_metadata["merged_chunks"] = buffer_count
-            merged_sections.append((buffer_text, buffer_metadata))
+            merged_sections.append(("\n\n".join(buffer_parts), buffer_metadata))
             if args.overlap > 0:
-                overlap_tokens = buffer_text.split()[-args.overlap :]
-                buffer_text = " ".join(overlap_tokens)
+                overlap_tokens = tail_tokens(buffer_parts, args.overlap)
+                buffer_parts = [" ".join(overlap_tokens)]
                 buffer_metadata = dict(chunk_metadata)
                 buffer_count = 1
+                buffer_tokens = len(overlap_tokens)
             else:
-                buffer_text = ""
+                buffer_parts = []
                 buffer_metadata = {}
                 buffer_count = 0
+                buffer_tokens = 0
 
-    if buffer_text:
-        if len(buffer_text.split()) >= args.min_tokens:
+    if buffer_parts:
+        if buffer_tokens >= args.min_tokens:
             if buffer_count > 1:
                 buffer_metadata = dict(buffer_metadata)
                 buffer_metadata["merged_chunks"] = buffer_count
-            merged_sections.append((buffer_text, buffer_metadata))
+            merged_sections.append(("\n\n".join(buffer_parts), buffer_metadata))
 
-    with open(args.output, "w", encoding="utf-8") as f:
+    with open(args.output, "wb") as f:
         for text, metadata in merged_sections:
             record = {
                 "text": text,
                 "metadata": metadata,
             }
-            f.write(json.dumps(record, ensure_ascii=True) + "\n")
+            f.write(orjson.dumps(record) + b"\n")
 
 
 if __name__ == "__main__":
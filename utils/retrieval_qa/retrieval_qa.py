@@ -1,82 +1,289 @@
 import argparse
+import asyncio
+import fcntl
 import os
+import shutil
 import sys
-from typing import Optional
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+import anyio
 import chromadb
+import diskcache
+import numpy as np
+import onnxruntime as ort
+import torch
 from fastapi import FastAPI
-from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langsmith import traceable
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from optimum.onnxruntime import ORTModelForSequenceClassification
 from pydantic import BaseModel
 from sentence_transformers import CrossEncoder
+from transformers import AutoTokenizer
 import uvicorn
 
 
-_reranker: Optional[CrossEncoder] = None
-
-
-def get_reranker(model_name: str) -> CrossEncoder:
-    global _reranker
-    if _reranker is None:
-        _reranker = CrossEncoder(model_name)
-    return _reranker
+# Avoid the HuggingFace tokenizers fork warning under forking servers.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def inference_threads() -> int:
+    # run_server divides the cores between workers via TORCH_NUM_THREADS.
+    return int(os.getenv("TORCH_NUM_THREADS", str(os.cpu_count() or 1)))
+
+
+torch.set_num_threads(inference_threads())
+
+
+_RERANK_MAX_LENGTH = 256
+
+
+class OnnxCrossEncoder:
+    # int8 ONNX Runtime session scoring (query, passage) pairs in one run.
+    def __init__(self, model_path: str, tokenizer, max_length: int = _RERANK_MAX_LENGTH):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = inference_threads()
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            [query] * len(passages),
+            passages,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self.input_names
+        }
+        logits = self.session.run(None, feeds)[0]
+        return logits.reshape(len(passages), -1)[:, 0]
+
+
+def export_int8_reranker(model_name: str, export_dir: str) -> str:
+    int8_path = os.path.join(export_dir, "model.int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+    parent_dir = os.path.dirname(export_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    # Cross-process lock so concurrent workers/containers export only once.
+    with open(f"{export_dir}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(int8_path):
+            return int8_path
+        # Export into a scratch directory and swap it in, so readers never see
+        # a partially written model.
+        tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=parent_dir)
+        try:
+            model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+            model.save_pretrained(tmp_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+            quantize_dynamic(
+                os.path.join(tmp_dir, "model.onnx"),
+                os.path.join(tmp_dir, "model.int8.onnx"),
+                weight_type=QuantType.QInt8,
+            )
+            # Drop any incomplete export left behind by an interrupted run.
+            shutil.rmtree(export_dir, ignore_errors=True)
+            os.replace(tmp_dir, export_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+    return int8_path
+
+
+def onnx_export_dir(model_name: str) -> str:
+    return os.path.join(
+        os.getenv("RERANK_ONNX_DIR", "/data/models"),
+        model_name.replace("/", "__"),
+    )
 
 
-def rerank_documents(query: str, docs, top_k: int, model_name: str):
-    if not docs:
+def load_onnx_reranker(model_name: str) -> OnnxCrossEncoder:
+    export_dir = onnx_export_dir(model_name)
+    model_path = export_int8_reranker(model_name, export_dir)
+    return OnnxCrossEncoder(model_path, AutoTokenizer.from_pretrained(export_dir))
+
+
+_rerankers: Dict[str, Union[CrossEncoder, OnnxCrossEncoder]] = {}
+_rerankers_lock = threading.Lock()
+
+
+def select_device() -> str:
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def resolve_backend(device: str) -> str:
+    backend = os.getenv("RERANK_BACKEND", "auto").lower()
+    if backend == "auto":
+        # int8 ONNX is fastest on CPU; accelerators run the torch model.
+        backend = "torch" if device != "cpu" else "onnx"
+    return backend
+
+
+def get_reranker(model_name: str) -> Union[CrossEncoder, OnnxCrossEncoder]:
+    reranker = _rerankers.get(model_name)
+    if reranker is not None:
+        return reranker
+    # Serialize loads so concurrent threads don't load the same model twice.
+    with _rerankers_lock:
+        if model_name in _rerankers:
+            return _rerankers[model_name]
+        device = select_device()
+        if resolve_backend(device) == "torch":
+            reranker = CrossEncoder(model_name, device=device, max_length=_RERANK_MAX_LENGTH)
+            if device == "cuda":
+                reranker.model.half()
+            reranker.model.eval()
+        else:
+            reranker = load_onnx_reranker(model_name)
+        _rerankers[model_name] = reranker
+    return reranker
+
+
+def score_pairs(reranker, query: str, passages: List[str]) -> np.ndarray:
+    if isinstance(reranker, OnnxCrossEncoder):
+        return reranker.score(query, passages)
+    # Tokenize all pairs in one call, padded to the longest pair, and score them
+    # in a single forward pass without autograd bookkeeping.
+    encoded = reranker.tokenizer(
+        [query] * len(passages),
+        passages,
+        padding=True,
+        truncation=True,
+        max_length=_RERANK_MAX_LENGTH,
+        return_tensors="pt",
+    ).to(reranker.model.device)
+    with torch.inference_mode():
+        logits = reranker.model(**encoded).logits
+    return logits.reshape(len(passages), -1)[:, 0].float().cpu().numpy()
+
+
+def rerank_documents(query: str, docs, top_k: int, reranker):
+    if top_k <= 0:
+        return []
+    # Nothing would be dropped, so skip the cross-encoder pass entirely.
+    if len(docs) <= top_k:
         return docs
-    reranker = get_reranker(model_name)
-    pairs = [(query, doc.page_content) for doc in docs]
-    scores = reranker.predict(pairs)
-    ranked = sorted(zip(docs, scores), key=lambda item: item[1], reverse=True)
-    return [doc for doc, _ in ranked[:top_k]]
+    scores = np.asarray(score_pairs(reranker, query, [doc.page_content for doc in docs]))
+    # Partial selection of the top_k, then order just those by score.
+    top_idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    top_idx = top_idx[np.argsort(-scores[top_idx])]
+    return [docs[i] for i in top_idx]
 
 
 class CrossEncoderRerankRetriever(BaseRetriever):
-    vectorstore: Chroma
+    collection: Any
     search_k: int = 20
     rerank_k: int = 8
     model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    # Resolved once in get_retriever so queries never touch model loading.
+    reranker: Any = None
+
+    def _query(self, query_embedding: Sequence[float]) -> List[Document]:
+        result = self.collection.query(
+            query_embeddings=[list(query_embedding)],
+            n_results=self.search_k,
+            include=["documents", "metadatas"],
+        )
+        return [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(result["documents"][0], result["metadatas"][0])
+        ]
 
     def _get_relevant_documents(self, query: str):
-        base_retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.search_k})
-        docs = base_retriever.invoke(query)
-        return rerank_documents(query, docs, self.rerank_k, self.model_name)
+        # Query Chroma directly with a cached query embedding instead of going
+        # through the langchain vectorstore/retriever wrappers.
+        docs = self._query(embed_query_cached(query))
+        return rerank_documents(query, docs, self.rerank_k, self.reranker)
 
     async def _aget_relevant_documents(self, query: str):
-        return self._get_relevant_documents(query)
+        # Push the cached embedding lookup and blocking Chroma/reranker work to
+        # threads so concurrent requests can interleave on one event loop.
+        query_embedding = await asyncio.to_thread(embed_query_cached, query)
+        docs = await asyncio.to_thread(self._query, query_embedding)
+        return await asyncio.to_thread(
+            rerank_documents, query, docs, self.rerank_k, self.reranker
+        )
+
 
+def rerank_model_name() -> str:
+    return os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
 
-def get_retriever(vectorstore: Chroma) -> CrossEncoderRerankRetriever:
+
+def get_retriever(collection, model_name: str) -> CrossEncoderRerankRetriever:
     search_k = int(os.getenv("RETRIEVAL_K", "20"))
     rerank_k = int(os.getenv("RERANK_TOP_K", "8"))
-    model_name = os.getenv(
-        "RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
-    )
     return CrossEncoderRerankRetriever(
-        vectorstore=vectorstore,
+        collection=collection,
         search_k=search_k,
         rerank_k=rerank_k,
         model_name=model_name,
+        reranker=get_reranker(model_name),
     )
 
 
-def build_chain(persist_dir: str, collection_name: str):
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(model="text-embedding-3-small")
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOpenAI:
+    return ChatOpenAI(model="gpt-4o", temperature=0)
+
+
+@lru_cache(maxsize=4)
+def get_chroma_client(persist_dir: str):
+    return chromadb.PersistentClient(path=persist_dir)
+
+
+@lru_cache(maxsize=1)
+def get_query_embedding_disk_cache() -> Optional[diskcache.Cache]:
+    cache_dir = os.getenv("QUERY_EMBEDDING_CACHE_DIR", "")
+    return diskcache.Cache(cache_dir) if cache_dir else None
+
+
+@lru_cache(maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")))
+def embed_query_cached(text: str) -> Tuple[float, ...]:
+    # In-process LRU in front of an optional disk cache that survives restarts.
+    disk_cache = get_query_embedding_disk_cache()
+    key = f"{get_embeddings().model}:{text}"
+    if disk_cache is not None:
+        cached = disk_cache.get(key)
+        if cached is not None:
+            return cached
+    vector = tuple(get_embeddings().embed_query(text))
+    if disk_cache is not None:
+        disk_cache.set(key, vector)
+    return vector
 
-    chroma_client = chromadb.PersistentClient(path=persist_dir)
-    vectorstore = Chroma(
-        client=chroma_client,
-        collection_name=collection_name,
-        embedding_function=embeddings,
-    )
 
-    retriever = get_retriever(vectorstore)
+def build_chain(persist_dir: str, collection_name: str, rerank_model: str):
+    collection = get_chroma_client(persist_dir).get_or_create_collection(name=collection_name)
+    retriever = get_retriever(collection, rerank_model)
 
     system_prompt = (
         "You are the Agent-AE Technical Director. Use the provided documentation "
@@ -93,10 +300,16 @@ def build_chain(persist_dir: str, collection_name: str):
         ("system", system_prompt),
     ])
 
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
-    docs_chain = create_stuff_documents_chain(llm, prompt)
+    docs_chain = create_stuff_documents_chain(get_llm(), prompt)
 
-    return create_retrieval_chain(retriever, docs_chain), vectorstore
+    return retriever, docs_chain
+
+
+@lru_cache(maxsize=4)
+def _build_chain_cached(persist_dir: str, collection_name: str, rerank_model: str):
+    # Reuse warm Chroma/OpenAI handles across requests for the same collection;
+    # the reranker model is part of the key so changing RERANK_MODEL takes effect.
+    return build_chain(persist_dir, collection_name, rerank_model)
 
 
 @traceable(name="AE_Technical_Director_RAG", run_type="chain")
@@ -106,11 +319,15 @@ def generate_ae_script(user_query: str) -> dict:
     persist_dir = os.getenv("CHROMA_PERSIST_DIR", "/data/chroma")
     collection_name = os.getenv("CHROMA_COLLECTION", "ae-scripting-guide")
 
-    chain, vectorstore = build_chain(persist_dir, collection_name)
-    docs = get_retriever(vectorstore).invoke(user_query)
-    result = chain.invoke({"input": user_query})
+    retriever, docs_chain = _build_chain_cached(
+        persist_dir, collection_name, rerank_model_name()
+    )
+    # Retrieve once and hand the documents to the stuff chain directly, rather
+    # than letting a retrieval chain run the retriever and reranker again.
+    docs = retriever.invoke(user_query)
+    answer = docs_chain.invoke({"input": user_query, "context": docs})
     return {
-        "answer": result["answer"],
+        "answer": answer,
         "source_documents": [doc.page_content for doc in docs],
     }
 
@@ -157,6 +374,12 @@ def parse_args() -> argparse.Namespace:
         default=8000,
         help="Port for the HTTP service.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "4")),
+        help="Number of Uvicorn worker processes for the HTTP service.",
+    )
     return parser.parse_args()
 
 
@@ -167,7 +390,7 @@ def main() -> None:
     validate_tracing_env()
 
     if args.serve:
-        run_server(args.host, args.port)
+        run_server(args.host, args.port, args.workers)
         return
 
     user_query: Optional[str] = args.query
@@ -177,9 +400,11 @@ def main() -> None:
     if not user_query:
         raise SystemExit("Provide --query or pass a prompt via stdin.")
 
-    chain, vectorstore = build_chain(args.persist_dir, args.collection)
+    retriever, _ = _build_chain_cached(
+        args.persist_dir, args.collection, rerank_model_name()
+    )
     if args.debug:
-        docs = get_retriever(vectorstore).invoke(user_query)
+        docs = retriever.invoke(user_query)
         print("Top-k retrieved chunks:")
         for idx, doc in enumerate(docs, start=1):
             snippet = doc.page_content[: args.debug_snippet_chars].replace("\n", " ")
@@ -195,10 +420,26 @@ class QueryRequest(BaseModel):
 app = FastAPI()
 
 
+@app.on_event("startup")
+def warm_chain() -> None:
+    _build_chain_cached(
+        os.getenv("CHROMA_PERSIST_DIR", "/data/chroma"),
+        os.getenv("CHROMA_COLLECTION", "ae-scripting-guide"),
+        rerank_model_name(),
+    )
+
+
+@app.on_event("startup")
+async def raise_thread_limit() -> None:
+    # Each query holds a worker thread for the full embed/search/rerank/LLM
+    # round trip, so the default 40-thread cap bounds concurrency.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = int(os.getenv("QUERY_THREAD_LIMIT", "200"))
+
+
 @app.post("/query")
-def query_endpoint(payload: QueryRequest):
-    result = generate_ae_script(payload.query)
-    return result
+async def query_endpoint(payload: QueryRequest):
+    return await anyio.to_thread.run_sync(generate_ae_script, payload.query)
 
 
 @app.get("/health")
@@ -206,8 +447,27 @@ def healthcheck():
     return {"status": "ok"}
 
 
-def run_server(host: str, port: int) -> None:
-    uvicorn.run(app, host=host, port=port)
+def run_server(host: str, port: int, workers: int = 1) -> None:
+    # Split the cores between workers so their torch/ORT pools don't
+    # oversubscribe the CPU; workers inherit this when they import the module.
+    os.environ.setdefault(
+        "TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, workers)))
+    )
+    # Export the int8 reranker once here, before the workers start and race
+    # each other through the export in their startup hooks.
+    if resolve_backend(select_device()) == "onnx":
+        model_name = rerank_model_name()
+        export_int8_reranker(model_name, onnx_export_dir(model_name))
+    # Workers need an import string; each process loads its own warm chain and reranker.
+    uvicorn.run(
+        "retrieval_qa:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        timeout_keep_alive=int(os.getenv("UVICORN_KEEP_ALIVE", "65")),
+    )
 
 
 def validate_tracing_env() -> None:
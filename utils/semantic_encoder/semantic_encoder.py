@@ -1,10 +1,11 @@
 import argparse
-import json
+import asyncio
 import os
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 
 import chromadb
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI
 
 
 def parse_args() -> argparse.Namespace:
@@ -32,27 +33,61 @@ def parse_args() -> argparse.Namespace:
         default=64,
         help="Number of chunks per embedding batch.",
     )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        help="Maximum number of embedding requests in flight.",
+    )
     return parser.parse_args()
 
 
-def load_chunks(path: str) -> List[Tuple[str, dict]]:
-    chunks: List[Tuple[str, dict]] = []
-    with open(path, "r", encoding="utf-8") as f:
+def load_chunks(path: str) -> Iterator[Tuple[str, dict]]:
+    with open(path, "rb") as f:
         for idx, line in enumerate(f):
             line = line.strip()
             if not line:
                 continue
-            record = json.loads(line)
+            record = orjson.loads(line)
             metadata = record.get("metadata", {})
             if not metadata:
                 metadata = {"chunk_index": idx}
-            chunks.append((record["text"], metadata))
-    return chunks
-
-
-def batched(items: List[Tuple[str, dict]], batch_size: int):
-    for i in range(0, len(items), batch_size):
-        yield items[i : i + batch_size]
+            yield record["text"], metadata
+
+
+def batched_chunks(
+    chunks: Iterable[Tuple[str, dict]],
+    batch_size: int,
+) -> Iterator[Tuple[List[str], List[dict]]]:
+    batch_texts: List[str] = []
+    batch_metadatas: List[dict] = []
+    for text, metadata in chunks:
+        batch_texts.append(text)
+        batch_metadatas.append(metadata)
+        if len(batch_texts) == batch_size:
+            yield batch_texts, batch_metadatas
+            batch_texts, batch_metadatas = [], []
+    if batch_texts:
+        yield batch_texts, batch_metadatas
+
+
+async def embed_batches(
+    client: AsyncOpenAI,
+    batches: List[List[str]],
+    max_concurrency: int,
+) -> List[List[List[float]]]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def embed(batch_texts: List[str]) -> List[List[float]]:
+        async with semaphore:
+            response = await client.embeddings.create(
+                model="text-embedding-3-small",
+                input=batch_texts,
+            )
+        return [item.embedding for item in response.data]
+
+    # gather preserves batch order, so inserts below stay deterministic.
+    return await asyncio.gather(*(embed(batch_texts) for batch_texts in batches))
 
 
 def main() -> None:
@@ -62,16 +97,19 @@ def main() -> None:
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is not set.")
 
-    chunks = load_chunks(args.input)
-    texts = [c[0] for c in chunks]
-    metadatas = [c[1] for c in chunks]
-
-    client = OpenAI(api_key=api_key)
+    if args.max_concurrency < 1:
+        raise ValueError("--max-concurrency must be at least 1.")
 
     chroma_client = chromadb.PersistentClient(path=args.persist_dir)
     collection = chroma_client.get_or_create_collection(
         name=args.collection,
-        metadata={"hnsw:space": "cosine"},
+        # The cross-encoder reranks the candidates, so first-stage search only
+        # needs adequate recall. hnswlib searches with max(search_ef, k), so an
+        # ef just above RETRIEVAL_K (20) adds little traversal beyond the k floor.
+        metadata={
+            "hnsw:space": "cosine",
+            "hnsw:search_ef": 32,
+        },
     )
     if collection.count() > 0:
         print(
@@ -79,17 +117,39 @@ def main() -> None:
         )
         return
 
-    for batch in batched(list(zip(texts, metadatas)), args.batch_size):
-        batch_texts = [item[0] for item in batch]
-        batch_metadatas = [item[1] for item in batch]
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=batch_texts,
+    batches = list(batched_chunks(load_chunks(args.input), args.batch_size))
+    client = AsyncOpenAI(api_key=api_key)
+    all_embeddings = asyncio.run(
+        embed_batches(
+            client,
+            [batch_texts for batch_texts, _ in batches],
+            args.max_concurrency,
+        )
+    )
+
+    next_id = collection.count()
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[dict] = []
+    vectors: List[List[float]] = []
+    for (batch_texts, batch_metadatas), embeddings in zip(batches, all_embeddings):
+        ids.extend(str(next_id + i) for i in range(len(batch_texts)))
+        next_id += len(batch_texts)
+        documents.extend(batch_texts)
+        metadatas.extend(batch_metadatas)
+        vectors.extend(embeddings)
+
+    # Insert in as few write transactions as Chroma allows rather than one per
+    # embedding batch.
+    add_batch_size = chroma_client.get_max_batch_size()
+    for i in range(0, len(ids), add_batch_size):
+        end = i + add_batch_size
+        collection.add(
+            ids=ids[i:end],
+            documents=documents[i:end],
+            metadatas=metadatas[i:end],
+            embeddings=vectors[i:end],
         )
-        embeddings = [item.embedding for item in response.data]
-        base_id = collection.count()
-        ids = [str(i) for i in range(base_id, base_id + len(batch))]
-        collection.add(ids=ids, documents=batch_texts, metadatas=batch_metadatas, embeddings=embeddings)
 
 
 if __name__ == "__main__":